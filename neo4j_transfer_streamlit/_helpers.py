@@ -0,0 +1,576 @@
+import streamlit as st
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+from types import MappingProxyType
+
+from neo4j_transfer import Neo4jCredentials, transfer_generator
+from neo4j import GraphDatabase, Driver, RoutingControl
+from neo4j.exceptions import ClientError, CypherSyntaxError
+from streamlit.connections import BaseConnection
+
+# Shared constants, cached resources and transfer helpers. Kept out of main.py
+# so they are imported once per process instead of re-executed on every rerun.
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_LOG_KEY = "transfer_log"
+TRANSFER_JOB_KEY = "transfer_job"
+TRANSFER_LOG_LIMIT = 100
+TRANSFER_LOG_SHOWN = 10
+TRANSFER_LOG_SHOWN_KEY = "transfer_log_shown"
+PROGRESS_POLL_SECONDS = 0.2
+TARGET_CREDENTIALS_KEY = "target_credentials"
+UNDO_JOBS_KEY = "undo_jobs"
+NODE_LABELS_KEY = "node_labels"
+RELATIONSHIP_TYPES_KEY = "relationship_types"
+SOURCE_URI_KEY = "source_uri"
+SOURCE_USER_KEY = "source_user"
+SOURCE_PASSWORD_KEY = "source_password"
+SOURCE_DATABASE_KEY = "source_database"
+SOURCE_CREDENTIALS_KEY = "source_credentials"
+TARGET_URI_KEY = "target_uri"
+TARGET_USER_KEY = "target_user"
+TARGET_PASSWORD_KEY = "target_password"
+TARGET_DATABASE_KEY = "target_database"
+POOL_SIZE_KEY = "pool_size"
+POOL_ACQUISITION_TIMEOUT_KEY = "pool_acquisition_timeout"
+POOL_MAX_LIFETIME_KEY = "pool_max_lifetime"
+
+DEFAULT_BATCH_SIZE = 10000
+UNDO_BATCH_SIZE = 10000
+
+# Driver settings read from the connection arguments or secrets.toml
+DRIVER_CONFIG_KEYS = (
+    "max_connection_pool_size",
+    "connection_acquisition_timeout",
+    "max_connection_lifetime",
+)
+
+# Bounded, in-memory caches for per-database lookups
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_ENTRIES = 16
+
+# Optionally load source and target database info from .env. Read-only, since
+# they are shared by every session
+SOURCE_ENV_DEFAULTS = MappingProxyType(
+    {
+        SOURCE_URI_KEY: os.environ.get("NEO4J_URI", None),
+        SOURCE_USER_KEY: os.environ.get("NEO4J_USERNAME", "neo4j"),
+        SOURCE_PASSWORD_KEY: os.environ.get("NEO4J_PASSWORD", None),
+        SOURCE_DATABASE_KEY: os.environ.get("NEO4J_DATABASE", "neo4j"),
+    }
+)
+TARGET_ENV_DEFAULTS = MappingProxyType(
+    {
+        TARGET_URI_KEY: os.environ.get("TARGET_NEO4J_URI", None),
+        TARGET_USER_KEY: os.environ.get("TARGET_NEO4J_USERNAME", "neo4j"),
+        TARGET_PASSWORD_KEY: os.environ.get("TARGET_NEO4J_PASSWORD", None),
+        TARGET_DATABASE_KEY: os.environ.get("TARGET_NEO4J_DATABASE", "neo4j"),
+    }
+)
+# Connection pool settings for the app's own drivers, adjustable from the sidebar
+POOL_DEFAULTS = MappingProxyType(
+    {
+        POOL_SIZE_KEY: int(os.environ.get("NEO4J_POOL_SIZE", 50)),
+        POOL_ACQUISITION_TIMEOUT_KEY: 60.0,
+        POOL_MAX_LIFETIME_KEY: 3600.0,
+    }
+)
+
+# st.fragment graduated from st.experimental_fragment in Streamlit 1.37
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+
+def show_older_logs():
+    shown = st.session_state.get(TRANSFER_LOG_SHOWN_KEY, TRANSFER_LOG_SHOWN)
+    st.session_state[TRANSFER_LOG_SHOWN_KEY] = shown + TRANSFER_LOG_SHOWN
+
+
+def source_connected() -> bool:
+    return SOURCE_CREDENTIALS_KEY in st.session_state
+
+
+def target_connected() -> bool:
+    return TARGET_CREDENTIALS_KEY in st.session_state
+
+
+def source_credentials() -> Neo4jCredentials:
+    # The credentials last used to connect, not the live form inputs
+    return st.session_state[SOURCE_CREDENTIALS_KEY]
+
+
+@st.cache_resource
+def init_logging() -> logging.Logger:
+    # Configure Transfer package logging once per process, not on every rerun.
+    # Quiet by default, since debug output is formatted for every batch written
+    logger = logging.getLogger("neo4j_transfer")
+    logger.setLevel(os.environ.get("NEO4J_TRANSFER_LOG", "WARNING").upper())
+    return logger
+
+
+@functools.lru_cache(maxsize=8)
+def credentials(
+    uri: str, username: str, password: str, database: str
+) -> Neo4jCredentials:
+    # Resubmitting the same details reuses the validated model. The password is
+    # held in this process-local cache, like it already is in session state.
+    # The URI is stripped here, so check_uri sees exactly what the driver gets
+    return Neo4jCredentials(
+        uri=uri.strip(), username=username, password=password, database=database
+    )
+
+
+def _creds_hash(c: Neo4jCredentials) -> int:
+    # The password doesn't change which database a cached result belongs to
+    return hash((c.uri, c.username, c.database))
+
+
+def _creds_auth_hash(c: Neo4jCredentials) -> tuple:
+    # A digest stands in for the password, so the raw value never becomes
+    # part of a cache key
+    digest = hashlib.blake2b((c.password or "").encode()).hexdigest()
+    return (c.uri, c.username, c.database, digest)
+
+
+class Neo4jConnection(BaseConnection[Driver]):
+    """st.connection wrapper around a neo4j Driver and its connection pool."""
+
+    def _connect(self, **kwargs) -> Driver:
+        # Arguments override a [connections.neo4j] section in secrets.toml.
+        # Only driver settings are passed on, since that section is shared by
+        # the source and target connections
+        settings = {**self._secrets.to_dict(), **kwargs}
+        driver = GraphDatabase.driver(
+            settings["uri"],
+            auth=(settings["username"], settings["password"]),
+            **{key: settings[key] for key in DRIVER_CONFIG_KEYS if key in settings},
+        )
+        # Verifying here means a connection that can't connect is never cached
+        try:
+            driver.verify_connectivity()
+        except Exception:
+            driver.close()
+            raise
+        self._just_verified = True
+        # Closes the pool once Streamlit evicts this connection and no running
+        # job still holds it, or at exit. Doesn't keep the connection alive
+        weakref.finalize(self, driver.close)
+        return driver
+
+    @property
+    def driver(self) -> Driver:
+        return self._instance
+
+    def verify(self):
+        # The first check after creating the driver would repeat _connect's
+        if self._just_verified:
+            self._just_verified = False
+            return
+        self._instance.verify_connectivity()
+
+    def schema(self, database: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        # Node labels and relationship types in a single round trip
+        try:
+            with self._instance.session(database=database) as session:
+                return session.execute_read(_read_schema)
+        except CypherSyntaxError as e:
+            # Servers that reject the subquery still get both lookups in parallel
+            logger.warning(
+                "Combined schema query rejected, falling back to two queries: %s", e
+            )
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            labels = pool.submit(
+                _column, self._instance, database, LABELS_QUERY, "label"
+            )
+            rel_types = pool.submit(
+                _column, self._instance, database, REL_TYPES_QUERY, "relationshipType"
+            )
+            return tuple(labels.result()), tuple(rel_types.result())
+
+    def counts(
+        self, database: str, labels: tuple[str, ...], rel_types: tuple[str, ...]
+    ) -> tuple[dict[str, int], dict[str, int]]:
+        try:
+            records, _, _ = self._instance.execute_query(
+                COUNTS_QUERY, database_=database, routing_=RoutingControl.READ
+            )
+            stats = records[0]
+            return (
+                {label: stats["labels"].get(label, 0) for label in labels},
+                {t: stats["relTypesCount"].get(t, 0) for t in rel_types},
+            )
+        except ClientError as e:
+            if e.code != "Neo.ClientError.Procedure.ProcedureNotFound":
+                raise
+            logger.warning("APOC not available, counting without it: %s", e)
+        if not labels and not rel_types:
+            return {}, {}
+        records, _, _ = self._instance.execute_query(
+            _counts_fallback_query(labels, rel_types),
+            labels=list(labels),
+            types=list(rel_types),
+            database_=database,
+            routing_=RoutingControl.READ,
+        )
+        counts = {"node": {}, "relationship": {}}
+        for record in records:
+            counts[record["kind"]][record["name"]] = record["count"]
+        return counts["node"], counts["relationship"]
+
+
+def connection_for(creds: Neo4jCredentials) -> Neo4jConnection:
+    # Streamlit caches one connection per set of arguments, so the driver is
+    # shared across reruns and sessions. Changing a pool setting in the sidebar
+    # gets a new connection on next use, and the cache is bounded like the
+    # others so replaced connections are evicted and their drivers closed
+    pool = {
+        key: st.session_state.get(key, value) for key, value in POOL_DEFAULTS.items()
+    }
+    return st.connection(
+        "neo4j",
+        type=Neo4jConnection,
+        uri=creds.uri,
+        username=creds.username,
+        password=creds.password,
+        max_connection_pool_size=pool[POOL_SIZE_KEY],
+        connection_acquisition_timeout=pool[POOL_ACQUISITION_TIMEOUT_KEY],
+        max_connection_lifetime=pool[POOL_MAX_LIFETIME_KEY],
+        max_entries=CACHE_MAX_ENTRIES,
+    )
+
+
+SCHEMA_QUERY = """
+CALL db.labels() YIELD label
+WITH collect(label) AS labels
+CALL {
+    CALL db.relationshipTypes() YIELD relationshipType
+    RETURN collect(relationshipType) AS relationship_types
+}
+RETURN labels, relationship_types
+"""
+LABELS_QUERY = "CALL db.labels() YIELD label RETURN label"
+REL_TYPES_QUERY = (
+    "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType"
+)
+
+
+def _column(driver: Driver, database: str, query: str, key: str) -> list:
+    # Result.value() gives a flat list without building a dict per record.
+    # Schema, version and count lookups are all reads, so clusters can serve
+    # them from a follower instead of the leader the transfer writes to
+    return driver.execute_query(
+        query,
+        database_=database,
+        routing_=RoutingControl.READ,
+        result_transformer_=lambda r: r.value(key),
+    )
+
+
+def _read_schema(tx) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    record = tx.run(SCHEMA_QUERY).single()
+    return tuple(record["labels"]), tuple(record["relationship_types"])
+
+
+@st.cache_resource(
+    ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _get_schema_cached(
+    auth_key: tuple, database: str, _creds: Neo4jCredentials
+) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # Keyed on a digest rather than the password, and the underscore keeps
+    # the credentials themselves out of the key. Results are shared rather
+    # than copied, so they are returned as tuples
+    return connection_for(_creds).schema(database)
+
+
+def get_schema(creds: Neo4jCredentials) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    return _get_schema_cached(_creds_auth_hash(creds), creds.database, creds)
+
+
+@st.cache_data(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=CACHE_MAX_ENTRIES,
+    show_spinner=False,
+    hash_funcs={Neo4jCredentials: _creds_auth_hash},
+)
+def verify_connection(creds: Neo4jCredentials) -> bool:
+    # Only successful checks are cached, failures raise and are retried next time
+    connection_for(creds).verify()
+    return True
+
+
+VALID_URI_PREFIXES = tuple(
+    f"{scheme}://"
+    for scheme in ("bolt", "bolt+s", "bolt+ssc", "neo4j", "neo4j+s", "neo4j+ssc")
+)
+
+
+def check_uri(uri: str):
+    # Catches typos before the driver spends a network round trip on them
+    if not uri or not uri.lower().startswith(VALID_URI_PREFIXES):
+        raise ValueError(f"URI must start with one of {', '.join(VALID_URI_PREFIXES)}")
+
+
+def fetch_schema(creds: Neo4jCredentials) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # A cached schema means these exact credentials have already connected
+    check_uri(creds.uri)
+    return get_schema(creds)
+
+
+def reconnect(creds: Neo4jCredentials) -> bool:
+    # Drops every cached check so the server is asked again
+    verify_connection.clear()
+    return credentials_valid(creds)
+
+
+def credentials_valid(creds) -> bool:
+    try:
+        check_uri(creds.uri)
+        return verify_connection(creds)
+    except Exception as e:
+        # Never render the credentials themselves, they include the password
+        st.error(f"Problem connecting with database at {creds.uri}: {e}")
+        return False
+
+
+@st.cache_data(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=CACHE_MAX_ENTRIES,
+    show_spinner=False,
+    hash_funcs={Neo4jCredentials: _creds_hash},
+)
+def get_server_version(creds: Neo4jCredentials) -> tuple[int, ...]:
+    records, _, _ = connection_for(creds).driver.execute_query(
+        "CALL dbms.components() YIELD name, versions "
+        "WHERE name = 'Neo4j Kernel' RETURN versions[0] AS version",
+        database_=creds.database,
+        routing_=RoutingControl.READ,
+    )
+    return tuple(int(p) for p in re.findall(r"\d+", records[0]["version"])[:2])
+
+
+# Reads the count store, so it costs the same however large the graph is
+COUNTS_QUERY = """
+CALL apoc.meta.stats() YIELD labels, relTypesCount
+RETURN labels, relTypesCount
+"""
+
+
+def _quote(name: str) -> str:
+    # Labels and types can't be parameters, so escape them as identifiers
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _counts_fallback_query(labels: tuple[str, ...], rel_types: tuple[str, ...]) -> str:
+    # Without APOC, still one round trip for every selected label and type.
+    # A literal label or type per branch lets each count come from the count
+    # store instead of scanning the graph
+    branches = [
+        f'MATCH (n:{_quote(label)}) RETURN "node" AS kind, $labels[{i}] AS name, count(n) AS count'
+        for i, label in enumerate(labels)
+    ] + [
+        f'MATCH ()-[r:{_quote(t)}]->() RETURN "relationship" AS kind, $types[{i}] AS name, count(r) AS count'
+        for i, t in enumerate(rel_types)
+    ]
+    return "\nUNION ALL\n".join(branches)
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def _get_counts_cached(
+    uri: str,
+    username: str,
+    database: str,
+    labels: tuple[str, ...],
+    rel_types: tuple[str, ...],
+    _creds: Neo4jCredentials,
+) -> tuple[dict[str, int], dict[str, int]]:
+    return connection_for(_creds).counts(database, labels, rel_types)
+
+
+def get_counts(
+    creds: Neo4jCredentials, labels: list[str], rel_types: list[str]
+) -> tuple[dict[str, int], dict[str, int]]:
+    # Counts for the selected node labels and relationship types, in one query.
+    # Sorted so the same selection hits the cache whatever order it was made in
+    return _get_counts_cached(
+        creds.uri,
+        creds.username,
+        creds.database,
+        tuple(sorted(labels)),
+        tuple(sorted(rel_types)),
+        creds,
+    )
+
+
+def refresh_counts():
+    _get_counts_cached.clear()
+
+
+def supports_concurrent_transactions(creds: Neo4jCredentials) -> bool:
+    # CALL { ... } IN CONCURRENT TRANSACTIONS was added in Neo4j 5.21
+    try:
+        return get_server_version(creds) >= (5, 21)
+    except Exception as e:
+        logger.warning("Could not determine target database version: %s", e)
+        return False
+
+
+def in_transactions(rows: int, concurrent: bool = False) -> str:
+    return f"IN {'CONCURRENT ' if concurrent else ''}TRANSACTIONS OF {rows} ROWS"
+
+
+def _drop_all(driver: Driver, database: str, kind: str, plural: str):
+    # Each DROP is its own schema transaction, so they can be sent in parallel
+    names = driver.execute_query(
+        f"SHOW {plural} YIELD name",
+        database_=database,
+        result_transformer_=lambda r: r.value("name"),
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        drops = [
+            pool.submit(
+                driver.execute_query,
+                f"DROP {kind} {_quote(name)} IF EXISTS",
+                database_=database,
+            )
+            for name in names
+        ]
+        for drop in concurrent.futures.as_completed(drops):
+            drop.result()
+
+
+def purge_target(driver: Driver, database: str, batch_size: int, concurrent=False):
+    # Same reset as neo4j_transfer's overwrite_target: constraints first, since
+    # dropping one also drops its backing index, then the remaining indexes
+    _drop_all(driver, database, "CONSTRAINT", "CONSTRAINTS")
+    _drop_all(driver, database, "INDEX", "INDEXES")
+    # Batched deletes so large databases don't need one huge transaction.
+    # CALL { } IN TRANSACTIONS requires an auto-commit transaction, hence session.run
+    # Deleting a relationship locks both of its end nodes, so concurrent
+    # batches could deadlock. Relationships go first in serial batches, then
+    # the nodes, which no longer have any, can go concurrently
+    rel_query = f"""
+    MATCH ()-[r]->()
+    CALL {{ WITH r DELETE r }} {in_transactions(batch_size)}
+    """
+    node_query = f"""
+    MATCH (n)
+    CALL {{ WITH n DETACH DELETE n }} {in_transactions(batch_size, concurrent)}
+    """
+    with driver.session(database=database) as session:
+        session.run(rel_query).consume()
+        session.run(node_query).consume()
+
+
+def undo_transfer(target: Neo4jConnection, database: str, spec):
+    # Same match as neo4j_transfer.undo, but deleted in batched transactions
+    # over the shared driver instead of in one transaction on a new driver
+    query = f"""
+    MATCH (n)
+    WHERE n.{_quote(spec.timestamp_key)} = $timestamp
+    CALL {{ WITH n DETACH DELETE n }} {in_transactions(UNDO_BATCH_SIZE)}
+    """
+    # Takes the connection rather than its driver, so the driver isn't closed
+    # by a cache eviction while the undo runs
+    with target.driver.session(database=database) as session:
+        result = session.run(query, timestamp=spec.timestamp.isoformat())
+        return result.consume().counters
+
+
+@st.cache_resource
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    # Shared worker pool so transfers run off the Streamlit script thread.
+    # Jobs get their drivers passed in, since cached functions need a script
+    # run context that worker threads don't have
+    return concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def default_config(labels: tuple[str, ...]) -> str:
+    return f"""
+{{
+    {", ".join(f'"{label}":{{"source":"element_id", "target":"_original_element_id"}}' for label in labels)}
+}}
+            """
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def parse_config(text: str) -> dict:
+    # Only re-parsed when the text area content actually changes
+    return json.loads(text)
+
+
+TRANSFER_STATUS = "Transfer in progress..."
+
+
+class TransferStopped(Exception):
+    """Raised on the worker thread when the user stops a transfer.
+
+    result is set when the transfer had already started writing, so the
+    partial transfer can still be logged and undone.
+    """
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def new_progress() -> dict:
+    # Shared between the script thread, which reads it to draw the progress
+    # bar and sets "stop", and the worker thread that updates it
+    return {"completion": 0.0, "status": TRANSFER_STATUS, "stop": threading.Event()}
+
+
+def stop_transfer(progress: dict):
+    # Stop button callback. The controller stops the library at its next
+    # check, the event covers a click before the worker has the controller
+    progress["stop"].set()
+    controller = progress.get("controller")
+    if controller is not None:
+        controller.request_stop()
+
+
+def run_transfer(
+    source_creds,
+    target_creds,
+    target: Neo4jConnection,
+    spec,
+    progress: dict,
+    concurrent_writes=False,
+):
+    # Runs on a worker thread, so no Streamlit calls in here
+    if spec.overwrite_target:
+        progress["status"] = "Purging target database..."
+        purge_target(
+            target.driver, target_creds.database, spec.batch_size, concurrent_writes
+        )
+        progress["status"] = TRANSFER_STATUS
+        spec = spec.model_copy(update={"overwrite_target": False})
+    updates = transfer_generator(source_creds, target_creds, spec)
+    # neo4j_transfer yields its stop controller before any results
+    progress["controller"] = next(updates)
+    if progress["stop"].is_set():
+        # Nothing has been written until the generator is resumed
+        updates.close()
+        raise TransferStopped("Transfer stopped by user")
+    result = None
+    for update in updates:
+        # A stopped transfer reports zero records, which float_completed
+        # would divide by
+        if update.records_total:
+            progress["completion"] = update.float_completed()
+        result = update
+    if result is None:
+        raise RuntimeError("No results were returned by the transfer")
+    # A stop that came after the last batch leaves a complete transfer
+    if not result.was_successful and progress["stop"].is_set():
+        # Batches written before the stop stay in the target
+        raise TransferStopped("Transfer stopped by user", result)
+    return result
@@ -1,21 +1,61 @@
 import streamlit as st
 import logging
+import itertools
 import json
-
-from neo4j_transfer import (
-    Neo4jCredentials,
-    TransferSpec,
-    transfer,
-    transfer_generator,
-    get_node_labels,
-    get_relationship_types,
-    validate_credentials,
-    undo,
+from collections import deque
+
+from neo4j_transfer import TransferSpec
+from neo4j.exceptions import AuthError, ClientError, ServiceUnavailable
+from neo4j_transfer_streamlit._helpers import (
+    DEFAULT_BATCH_SIZE,
+    NODE_LABELS_KEY,
+    POOL_ACQUISITION_TIMEOUT_KEY,
+    POOL_DEFAULTS,
+    POOL_MAX_LIFETIME_KEY,
+    POOL_SIZE_KEY,
+    RELATIONSHIP_TYPES_KEY,
+    SOURCE_CREDENTIALS_KEY,
+    SOURCE_DATABASE_KEY,
+    SOURCE_ENV_DEFAULTS,
+    SOURCE_PASSWORD_KEY,
+    SOURCE_URI_KEY,
+    SOURCE_USER_KEY,
+    TARGET_CREDENTIALS_KEY,
+    TARGET_DATABASE_KEY,
+    TARGET_ENV_DEFAULTS,
+    TARGET_PASSWORD_KEY,
+    TARGET_URI_KEY,
+    TARGET_USER_KEY,
+    TRANSFER_JOB_KEY,
+    TRANSFER_LOG_KEY,
+    TRANSFER_LOG_LIMIT,
+    TRANSFER_LOG_SHOWN,
+    TRANSFER_LOG_SHOWN_KEY,
+    PROGRESS_POLL_SECONDS,
+    UNDO_JOBS_KEY,
+    credentials,
+    credentials_valid,
+    default_config,
+    fragment,
+    connection_for,
+    get_executor,
+    fetch_schema,
+    get_counts,
+    TransferStopped,
+    init_logging,
+    new_progress,
+    parse_config,
+    reconnect,
+    refresh_counts,
+    run_transfer,
+    show_older_logs,
+    stop_transfer,
+    source_connected,
+    source_credentials,
+    supports_concurrent_transactions,
+    target_connected,
+    undo_transfer,
 )
-import os
-
-
-# Configure Transfer package logging
 
 
 # Setup
@@ -23,75 +63,37 @@ st.set_page_config(
     page_title="Neo4j Transfer Tool", layout="wide", initial_sidebar_state="collapsed"
 )
 
-s_nodes = False
-s_relationships = False
-s_credentials = False
-t_credentials = False
-
-TRANSFER_LOG_KEY = "transfer_log"
-NODE_LABELS_KEY = "node_labels"
-RELATIONSHIP_TYPES_KEY = "relationship_types"
-SOURCE_URI_KEY = "source_uri"
-SOURCE_USER_KEY = "source_user"
-SOURCE_PASSWORD_KEY = "source_password"
-SOURCE_DATABASE_KEY = "source_database"
-
 if TRANSFER_LOG_KEY not in st.session_state:
-    # Store a list of dictionaries containing transfer data
-    st.session_state[TRANSFER_LOG_KEY] = []
-if NODE_LABELS_KEY not in st.session_state:
-    st.session_state[NODE_LABELS_KEY] = None
-if RELATIONSHIP_TYPES_KEY not in st.session_state:
-    st.session_state[RELATIONSHIP_TYPES_KEY] = None
-
-node_labels = None
-rel_types = None
-
-# Optionally load source database info from .env
-if SOURCE_URI_KEY not in st.session_state:
-    d_s_uri = os.environ.get("NEO4J_URI", None)
-    st.session_state[SOURCE_URI_KEY] = d_s_uri
-if SOURCE_USER_KEY not in st.session_state:
-    d_s_user = os.environ.get("NEO4J_USERNAME", "neo4j")
-    st.session_state[SOURCE_USER_KEY] = d_s_user
-if SOURCE_PASSWORD_KEY not in st.session_state:
-    d_s_password = os.environ.get("NEO4J_PASSWORD", None)
-    st.session_state[SOURCE_PASSWORD_KEY] = d_s_password
-if SOURCE_DATABASE_KEY not in st.session_state:
-    d_s_db = os.environ.get("NEO4J_DATABASE", "neo4j")
-    st.session_state[SOURCE_DATABASE_KEY] = d_s_db
-
-logger = logging.getLogger("neo4j_transfer")
-logger.setLevel(logging.DEBUG)
-
-
-@st.cache_data(ttl="5m")
-def get_nodes(_creds) -> list[str]:
-    try:
-        s_nodes = get_node_labels(_creds)
-        return s_nodes
-    except Exception as e:
-        st.error(
-            f"Problem getting source nodes from database with creds: {_creds}: {e}"
-        )
-
+    # Store the most recent transfers, newest first
+    st.session_state[TRANSFER_LOG_KEY] = deque(maxlen=TRANSFER_LOG_LIMIT)
+if UNDO_JOBS_KEY not in st.session_state:
+    # Pending undo futures keyed by transfer timestamp
+    st.session_state[UNDO_JOBS_KEY] = {}
 
-@st.cache_data(ttl="5m")
-def get_relationships(_creds) -> list[str]:
-    try:
-        rels = get_relationship_types(_creds)
-        return rels
-    except Exception as e:
-        st.error(
-            f"Problem getting relationships from database with creds: {_creds}: {e}"
-        )
+# Optionally load source and target database info and pool settings from .env
+defaults = {**SOURCE_ENV_DEFAULTS, **TARGET_ENV_DEFAULTS, **POOL_DEFAULTS}
+for key, value in defaults.items():
+    if key not in st.session_state:
+        st.session_state[key] = value
 
+logger = init_logging()
 
-def credentials_valid(creds) -> bool:
-    try:
-        validate_credentials(creds)
-    except Exception as e:
-        st.error(f"Problem connecting with database with creds: {creds}: {e}")
+with st.sidebar:
+    # Drawn on every run, before anything can st.stop(), so the values persist
+    with st.expander("Connection Pool"):
+        st.number_input("Max pool size", min_value=1, step=1, key=POOL_SIZE_KEY)
+        st.number_input(
+            "Acquisition timeout (seconds)",
+            min_value=1.0,
+            step=5.0,
+            key=POOL_ACQUISITION_TIMEOUT_KEY,
+        )
+        st.number_input(
+            "Max connection lifetime (seconds)",
+            min_value=60.0,
+            step=60.0,
+            key=POOL_MAX_LIFETIME_KEY,
+        )
 
 
 # Start UI
@@ -99,51 +101,53 @@ c1, c2, c3 = st.columns(3)
 with c1:
     st.write("Source Neo4j Database")
 
-    s_uri = st.text_input(
-        "URI",
-        st.session_state[SOURCE_URI_KEY],
-        key="s_uri",
-        help="If targeting a local db instance. Use Ngrok or other tunneling service. Once up and running, add 'bolt://<ngrok_tcp_address>' in this field.",
-    )
-    s_user = st.text_input("Username", st.session_state[SOURCE_USER_KEY], key="s_user")
-    s_password = st.text_input(
-        "Password",
-        st.session_state[SOURCE_PASSWORD_KEY],
-        key="s_password",
-        type="password",
-    )
-    s_db = st.text_input("Database", st.session_state[SOURCE_DATABASE_KEY], key="s_db")
+    # Inputs only submit on Connect, so typing doesn't rerun the whole app
+    with st.form("source"):
+        s_uri = st.text_input(
+            "URI",
+            key=SOURCE_URI_KEY,
+            help="If targeting a local db instance. Use Ngrok or other tunneling service. Once up and running, add 'bolt://<ngrok_tcp_address>' in this field.",
+        )
+        s_user = st.text_input("Username", key=SOURCE_USER_KEY)
+        s_password = st.text_input(
+            "Password",
+            key=SOURCE_PASSWORD_KEY,
+            type="password",
+        )
+        s_db = st.text_input("Database", key=SOURCE_DATABASE_KEY)
+        submitted = st.form_submit_button("Connect")
+
     if not bool(s_uri) or not bool(s_password):
         st.info(f"Enter source database info")
 
-    if st.button("Connect"):
+    if submitted and s_uri and s_password:
         try:
-            s_creds = Neo4jCredentials(
-                uri=s_uri, username=s_user, password=s_password, database=s_db
-            )
-            validate_credentials(s_creds)
-            node_labels = get_nodes(s_creds)
-            rel_types = get_relationships(s_creds)
+            s_creds = credentials(s_uri, s_user, s_password, s_db)
+            node_labels, rel_types = fetch_schema(s_creds)
             print(f"node_labels returned: {node_labels}")
             print(f"rel_types returned: {rel_types}")
-            st.session_state[NODE_LABELS_KEY] = node_labels
-            st.session_state[RELATIONSHIP_TYPES_KEY] = rel_types
-            st.session_state[SOURCE_URI_KEY] = s_uri
-            st.session_state[SOURCE_USER_KEY] = s_user
-            st.session_state[SOURCE_PASSWORD_KEY] = s_password
-            st.session_state[SOURCE_DATABASE_KEY] = s_db
+            # Reconnecting with the same details leaves session state untouched
+            connected = {
+                NODE_LABELS_KEY: node_labels,
+                RELATIONSHIP_TYPES_KEY: rel_types,
+                SOURCE_CREDENTIALS_KEY: s_creds,
+            }
+            for key, value in connected.items():
+                if st.session_state.get(key) != value:
+                    st.session_state[key] = value
             st.success("Connection successful")
+        except (ServiceUnavailable, AuthError, ClientError) as e:
+            st.error(f"Could not connect to source database: {e}")
+            st.stop()
         except Exception as e:
             st.error(f"Problem connecting with database: {e}")
             st.stop()
 
-with c2:
-    # Display source data options
-    node_options = st.session_state.get(NODE_LABELS_KEY, None)
-    relationship_options = st.session_state.get(RELATIONSHIP_TYPES_KEY, None)
-    if node_options is None or relationship_options is None:
-        st.stop()
 
+@fragment
+def render_transfer_options():
+    # Runs as a fragment so changing selections or advanced options only
+    # reruns this column, not the source and target forms
     st.write("Transfer Options")
 
     get_nodes = st.multiselect(
@@ -159,59 +163,102 @@ with c2:
 
     if len(get_nodes) == 0 and len(get_relationships) == 0:
         st.info(f"Select nodes and/or relationships to transfer")
+    else:
+        try:
+            node_counts, rel_counts = get_counts(
+                source_credentials(), get_nodes, get_relationships
+            )
+            # Nodes can carry several selected labels, so their counts are
+            # shown per label rather than summed. A relationship has one type
+            per_label = ", ".join(f"{n} {label}" for label, n in node_counts.items())
+            st.caption(
+                f"Nodes per label: {per_label or 'none'}. {sum(rel_counts.values())} relationships selected"
+            )
+        except Exception as e:
+            st.warning(f"Could not count source records: {e}")
+        # Counts are cached for five minutes, so interacting with other widgets
+        # doesn't re-query the source
+        st.button("Refresh counts", on_click=refresh_counts)
 
+    batch_size = DEFAULT_BATCH_SIZE
     enable_advanced = st.toggle("Enable Advanced Options")
     if enable_advanced:
-
-        def default_config(labels: list[str]) -> str:
-            return f"""
-{{
-    {", ".join(f'"{label}":{{"source":"element_id", "target":"_original_element_id"}}' for label in labels)}
-}}
-            """
+        batch_size = st.number_input(
+            "Batch size",
+            min_value=100,
+            max_value=100000,
+            value=DEFAULT_BATCH_SIZE,
+            step=1000,
+            help="Number of records written per UNWIND batch. Larger batches mean fewer round trips but more memory per transaction on the target database.",
+        )
 
         custom_nodes_config = st.text_area(
             "Custom Nodes Config",
-            default_config(get_nodes),
+            default_config(tuple(get_nodes)),
             key="custom_nodes_config",
         )
         custom_relationships_config = st.text_area(
             "Custom Relationships Config",
-            default_config(get_relationships),
+            default_config(tuple(get_relationships)),
             key="custom_relationships_config",
         )
-        get_nodes = json.loads(custom_nodes_config)
-        get_relationships = json.loads(custom_relationships_config)
+        get_nodes = parse_config(custom_nodes_config)
+        get_relationships = parse_config(custom_relationships_config)
         print(f"nodes config: {get_nodes}")
         print(f"relationships config: {get_relationships}")
 
+    return get_nodes, get_relationships, batch_size
+
+
+with c2:
+    # Display source data options
+    if not source_connected():
+        st.stop()
+
+    get_nodes, get_relationships, batch_size = render_transfer_options()
+
 
 with c3:
     st.write("Target Neo4j Database")
 
-    # Optionally load target database credentials from .env
-    t_s_uri = os.environ.get("TARGET_NEO4J_URI", None)
-    t_s_user = os.environ.get("TARGET_NEO4J_USERNAME", "neo4j")
-    t_s_password = os.environ.get("TARGET_NEO4J_PASSWORD", None)
-    t_s_db = os.environ.get("TARGET_NEO4J_DATABASE", "neo4j")
-
-    t_uri = st.text_input(
-        "URI",
-        t_s_uri,
-        key="t_uri",
-        help="If targeting a local db instance. Use Ngrok or other tunneling service. Once up and running, add 'bolt://<ngrok_tcp_address>' in this field.",
-    )
-    t_user = st.text_input("Username", t_s_user, key="t_user")
-    t_password = st.text_input(
-        "Password", t_s_password, key="t_password", type="password"
-    )
-    t_db = st.text_input("Database", t_s_db, key="t_db")
-    if t_uri and t_password:
-        t_creds = Neo4jCredentials(
-            uri=t_uri, username=t_user, password=t_password, database=t_db
+    # Credentials are only built and validated when the form is submitted
+    with st.form("target"):
+        t_uri = st.text_input(
+            "URI",
+            key=TARGET_URI_KEY,
+            help="If targeting a local db instance. Use Ngrok or other tunneling service. Once up and running, add 'bolt://<ngrok_tcp_address>' in this field.",
+        )
+        t_user = st.text_input("Username", key=TARGET_USER_KEY)
+        t_password = st.text_input(
+            "Password",
+            key=TARGET_PASSWORD_KEY,
+            type="password",
         )
-        credentials_valid(t_creds)
+        t_db = st.text_input("Database", key=TARGET_DATABASE_KEY)
+        target_submitted = st.form_submit_button("Connect target")
+
+    if target_submitted and t_uri and t_password:
+        new_t_creds = credentials(t_uri, t_user, t_password, t_db)
+        # Only stored once validated, so re-submitting the connected target
+        # skips the handshake. Other targets are checked at most once per
+        # cache TTL by verify_connection
+        if st.session_state.get(TARGET_CREDENTIALS_KEY, None) != new_t_creds:
+            if credentials_valid(new_t_creds):
+                st.session_state[TARGET_CREDENTIALS_KEY] = new_t_creds
+                st.success("Connection successful")
+            else:
+                st.session_state.pop(TARGET_CREDENTIALS_KEY, None)
+
+    t_creds = st.session_state.get(TARGET_CREDENTIALS_KEY, None)
+    if t_creds is not None and st.button("Reconnect target"):
+        # Re-checks the connected target even if a recent check is cached
+        if reconnect(t_creds):
+            st.success("Connection successful")
+        else:
+            del st.session_state[TARGET_CREDENTIALS_KEY]
+            t_creds = None
 
+    if target_connected():
         add_default_data = st.checkbox(
             "Add default properties",
             value=True,
@@ -224,60 +271,157 @@ with c3:
             help="Purge all current data in the target database prior to transferring data from the source database. Deletes ALL data on target database!",
         )
 
+        concurrent_supported = supports_concurrent_transactions(t_creds)
+        concurrent_checked = st.checkbox(
+            "Concurrent write transactions (5.21+)",
+            value=False,
+            disabled=not (overwrite_target and concurrent_supported),
+            help="Delete nodes in the batched purge of the target database with CALL { ... } IN CONCURRENT TRANSACTIONS, after its relationships are deleted. Requires Neo4j 5.21 or later on the target.",
+        )
+        # A disabled checkbox still returns its last value
+        concurrent_writes = (
+            overwrite_target and concurrent_checked and concurrent_supported
+        )
+
         spec = TransferSpec(
             node_labels=get_nodes,
             relationship_types=get_relationships,
             should_append_data=add_default_data,
             overwrite_target=overwrite_target,
+            batch_size=batch_size,
         )
 
-        if st.button("Start Transfer"):
+        if st.button("Start Transfer", disabled=TRANSFER_JOB_KEY in st.session_state):
             if len(get_nodes) == 0:
                 st.warning("Select at least one node label to start a transfer")
             else:
-                progress_indicator = st.progress(0.0)
-
-                try:
-                    source_creds = Neo4jCredentials(
-                        uri=st.session_state[SOURCE_URI_KEY],
-                        username=st.session_state[SOURCE_USER_KEY],
-                        password=st.session_state[SOURCE_PASSWORD_KEY],
-                        database=st.session_state[SOURCE_DATABASE_KEY],
-                    )
-
-                    for result in transfer_generator(source_creds, t_creds, spec):
-                        if result is None:
-                            print(f"Unexpected result: {result}")
-                            continue
-                        completion = result.float_completed()
-                        progress_text = f"Upload {round(completion * 100)}% complete"
-                        progress_indicator.progress(completion, progress_text)
-
-                    # Store list of transfer ids so an undo option is possible
-                    st.session_state[TRANSFER_LOG_KEY].insert(
-                        0, {"transfer_spec": spec.dict(), "result": result.dict()}
-                    )
-                    msg = f"Transfer complete - {result}"
-                    logging.info(msg)
-                    st.success(msg)
-                except Exception as e:
-                    msg = f"Problem transferring: {e}"
-                    logging.error(msg)
-                    st.error(msg)
+                progress = new_progress()
+                future = get_executor().submit(
+                    run_transfer,
+                    source_credentials(),
+                    t_creds,
+                    connection_for(t_creds),
+                    spec,
+                    progress,
+                    concurrent_writes,
+                )
+                st.session_state[TRANSFER_JOB_KEY] = {
+                    "future": future,
+                    "spec": spec,
+                    "progress": progress,
+                }
 
     else:
         st.info(f"Enter target database info")
 
-with st.sidebar:
+
+@fragment(run_every=PROGRESS_POLL_SECONDS)
+def render_transfer_progress():
+    # Reruns on its own timer while the transfer runs on a worker thread, so
+    # the rest of the app stays responsive. Reads the job from session state
+    # rather than taking it as an argument, since a timed rerun can outlive it
+    job = st.session_state.get(TRANSFER_JOB_KEY, None)
+    if job is None:
+        return
+    if job["future"].done():
+        # Full rerun so the result is recorded and the log updated
+        st.rerun()
+    completion = job["progress"]["completion"]
+    with st.status(job["progress"]["status"]):
+        st.progress(completion, f"Upload {round(completion * 100)}% complete")
+    st.button(
+        "Stop Transfer",
+        on_click=stop_transfer,
+        args=(job["progress"],),
+        disabled=job["progress"]["stop"].is_set(),
+    )
+
+
+# Show any transfer running in the background
+job = st.session_state.get(TRANSFER_JOB_KEY, None)
+if job is not None and not job["future"].done():
+    with c3:
+        render_transfer_progress()
+elif job is not None:
+    with c3:
+        del st.session_state[TRANSFER_JOB_KEY]
+        try:
+            result = job["future"].result()
+            msg = f"Transfer complete - {result}"
+            logging.info(msg)
+            st.success(msg)
+        except TransferStopped as e:
+            # Still logged when data was written, so it can be undone
+            result = e.result
+            st.warning(f"{e}")
+        except Exception as e:
+            result = None
+            msg = f"Problem transferring: {e}"
+            logging.error(msg)
+            st.error(msg)
+        if result is not None:
+            # Store list of transfer ids so an undo option is possible
+            spec_dump = job["spec"].model_dump(mode="json")
+            log = {
+                "transfer_spec": spec_dump,
+                "result": result.model_dump(mode="json"),
+                "timestamp": spec_dump["timestamp"],
+            }
+            # Serialised once, compactly, as up to TRANSFER_LOG_LIMIT entries
+            # stay in session state. The result is only displayed
+            log["json"] = json.dumps(log, separators=(",", ":"))
+            del log["result"]
+            st.session_state[TRANSFER_LOG_KEY].appendleft(log)
+
+
+@fragment
+def render_transfer_log():
+    # Runs as a fragment so Undo clicks only rerun the log, not the whole app
     st.header("Transfer Log")
     logs = st.session_state[TRANSFER_LOG_KEY]
     if len(logs) == 0:
         st.write("<No prior transfers yet>")
-    for log in logs:
-        ts = log["transfer_spec"]["timestamp"]
+    # Only the newest entries are drawn, a page at a time
+    shown = st.session_state.get(TRANSFER_LOG_SHOWN_KEY, TRANSFER_LOG_SHOWN)
+    undo_jobs = st.session_state[UNDO_JOBS_KEY]
+    for log in itertools.islice(logs, shown):
+        ts = log["timestamp"]
         with st.expander(f"{ts}"):
-            st.code(f"{log}")
-            if st.button("Undo", key=ts):
+            st.code(log["json"], language="json")
+            future = undo_jobs.get(f"{ts}", None)
+            if future is not None and not future.done():
+                st.info("Undo in progress...")
+            elif future is not None:
+                del undo_jobs[f"{ts}"]
+                try:
+                    counters = future.result()
+                    st.info(
+                        f"Undo complete - deleted {counters.nodes_deleted} nodes and {counters.relationships_deleted} relationships"
+                    )
+                except Exception as e:
+                    st.error(f"Problem undoing transfer: {e}")
+            # Stable per-transfer key so entries never collide as the log grows
+            elif st.button("Undo", key=f"undo_{ts}", disabled=t_creds is None):
                 u_spec = TransferSpec(**log["transfer_spec"])
-                result = undo(t_creds, u_spec)
-                st.info(result.__dict__)
+                undo_jobs[f"{ts}"] = get_executor().submit(
+                    undo_transfer, connection_for(t_creds), t_creds.database, u_spec
+                )
+                # Full rerun so the undo poll below starts
+                st.rerun()
+    if len(logs) > shown:
+        st.button(f"Show older ({len(logs) - shown})", on_click=show_older_logs)
+
+
+@fragment(run_every=PROGRESS_POLL_SECONDS)
+def render_undo_poll():
+    # Ticks on its own timer while undos run on worker threads, so the rest of
+    # the app stays responsive. Draws nothing itself
+    if all(f.done() for f in st.session_state[UNDO_JOBS_KEY].values()):
+        # Full rerun so the log shows the undo results
+        st.rerun()
+
+
+with st.sidebar:
+    render_transfer_log()
+    if any(not f.done() for f in st.session_state[UNDO_JOBS_KEY].values()):
+        render_undo_poll()
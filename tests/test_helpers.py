@@ -0,0 +1,140 @@
+import datetime
+import unittest
+from unittest import mock
+
+from neo4j_transfer import Neo4jCredentials, StoppableTransfer, TransferSpec
+from neo4j_transfer.models import UploadResult
+
+from neo4j_transfer_streamlit import _helpers
+
+
+def upload_result(total, completed):
+    return UploadResult(
+        started_at=datetime.datetime.now(),
+        records_total=total,
+        records_completed=completed,
+        was_successful=True,
+        nodes_created=completed,
+        relationships_created=0,
+        properties_set=0,
+    )
+
+
+class RunTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.creds = Neo4jCredentials(
+            uri="neo4j://localhost", username="neo4j", password="password"
+        )
+
+    def test_multiple_labels_run_as_one_transfer(self):
+        # Splitting by label would copy a node labelled both Person and Actor
+        # twice, and drop relationships between Person and Movie nodes
+        spec = TransferSpec(node_labels=["Person", "Actor", "Movie"])
+        specs = []
+
+        def fake_generator(source_creds, target_creds, spec):
+            specs.append(spec)
+            yield StoppableTransfer()
+            yield upload_result(10, 5)
+            yield upload_result(10, 10)
+
+        with mock.patch.object(_helpers, "transfer_generator", fake_generator):
+            result = _helpers.run_transfer(
+                self.creds, self.creds, None, spec, _helpers.new_progress()
+            )
+
+        self.assertEqual(len(specs), 1)
+        self.assertEqual(specs[0].node_labels, ["Person", "Actor", "Movie"])
+        self.assertEqual(specs[0].relationship_types, [])
+        self.assertEqual(result.records_completed, 10)
+
+    def test_stop_goes_through_the_controller(self):
+        spec = TransferSpec(node_labels=["Person"])
+        progress = _helpers.new_progress()
+
+        def fake_generator(source_creds, target_creds, spec):
+            controller = StoppableTransfer()
+            yield controller
+            _helpers.stop_transfer(progress)
+            self.assertTrue(controller._stop_requested)
+            # The library's result for a stopped transfer has no records
+            yield upload_result(0, 0).model_copy(update={"was_successful": False})
+
+        with mock.patch.object(_helpers, "transfer_generator", fake_generator):
+            with self.assertRaises(_helpers.TransferStopped) as stopped:
+                _helpers.run_transfer(self.creds, self.creds, None, spec, progress)
+        # Kept so the partial transfer is still logged with an Undo
+        self.assertIsNotNone(stopped.exception.result)
+
+    def test_late_stop_keeps_a_completed_transfer(self):
+        spec = TransferSpec(node_labels=["Person"])
+        progress = _helpers.new_progress()
+
+        def fake_generator(source_creds, target_creds, spec):
+            yield StoppableTransfer()
+            # Clicked after the library's last check
+            _helpers.stop_transfer(progress)
+            yield upload_result(10, 10)
+
+        with mock.patch.object(_helpers, "transfer_generator", fake_generator):
+            result = _helpers.run_transfer(self.creds, self.creds, None, spec, progress)
+        self.assertEqual(result.records_completed, 10)
+
+
+class CheckUriTest(unittest.TestCase):
+    def test_checks_the_uri_passed_to_the_driver(self):
+        creds = _helpers.credentials(" neo4j+s://host ", "neo4j", "password", "neo4j")
+        self.assertEqual(creds.uri, "neo4j+s://host")
+        _helpers.check_uri(creds.uri)
+
+    def test_rejects_invalid_uris(self):
+        # The driver accepts any case of scheme, but not surrounding spaces
+        _helpers.check_uri("NEO4J+S://host")
+        for uri in ("", "http://host", " neo4j://host"):
+            with self.assertRaises(ValueError):
+                _helpers.check_uri(uri)
+
+
+class CountsFallbackQueryTest(unittest.TestCase):
+    def test_quotes_labels_and_types(self):
+        self.assertEqual(_helpers._quote("Person"), "`Person`")
+        self.assertEqual(_helpers._quote("My Label"), "`My Label`")
+        # A backtick is escaped by doubling it, so a name can't end the identifier
+        self.assertEqual(
+            _helpers._quote("a`) DETACH DELETE (n"), "`a``) DETACH DELETE (n`"
+        )
+
+    def test_branches_return_the_same_columns(self):
+        query = _helpers._counts_fallback_query(("Person", "Odd`Label"), ("ACTED_IN",))
+        branches = query.split("\nUNION ALL\n")
+        self.assertEqual(len(branches), 3)
+        # UNION ALL needs every branch to return the same columns, in order
+        for branch in branches:
+            self.assertRegex(branch, r"RETURN .* AS kind, .* AS name, .* AS count$")
+        self.assertIn("MATCH (n:`Person`)", branches[0])
+        self.assertIn("$labels[0] AS name", branches[0])
+        self.assertIn("MATCH (n:`Odd``Label`)", branches[1])
+        self.assertIn("$labels[1] AS name", branches[1])
+        self.assertIn("MATCH ()-[r:`ACTED_IN`]->()", branches[2])
+        self.assertIn("$types[0] AS name", branches[2])
+
+
+class PurgeTargetTest(unittest.TestCase):
+    def test_only_node_batches_run_concurrently(self):
+        driver = mock.MagicMock()
+        driver.execute_query.return_value = []
+        session = driver.session.return_value.__enter__.return_value
+
+        _helpers.purge_target(driver, "neo4j", 500, concurrent=True)
+
+        rel_query, node_query = [c.args[0] for c in session.run.call_args_list]
+        # Concurrent relationship deletes could deadlock on shared end nodes
+        self.assertIn("DELETE r", rel_query)
+        self.assertIn("IN TRANSACTIONS OF 500 ROWS", rel_query)
+        self.assertNotIn("CONCURRENT", rel_query)
+        self.assertIn("DETACH DELETE n", node_query)
+        self.assertIn("IN CONCURRENT TRANSACTIONS OF 500 ROWS", node_query)
+
+
+if __name__ == "__main__":
+    unittest.main()